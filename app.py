@@ -1,168 +1,866 @@
+import binascii
 import io
-import base64
+import logging
+import multiprocessing
 import os
+import re
+import shutil
+import socket
 import subprocess
 import tempfile
-from flask import Flask, request, jsonify
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import blake3
+import fitz
+import orjson
+import pikepdf
+import pybase64
+from flask import Flask, Response, request, jsonify, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+class _OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, so jsonify() and get_json() skip the stdlib json module."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
-CORS(app)
+app.json = _OrjsonProvider(app)
+# app.logger has no level of its own and gunicorn leaves the root logger at WARNING, which would
+# swallow every INFO line; log through gunicorn's error log (handlers and --log-level) instead,
+# or at INFO when run without gunicorn
+_gunicorn_logger = logging.getLogger('gunicorn.error')
+if _gunicorn_logger.handlers:
+    app.logger.handlers = _gunicorn_logger.handlers
+    app.logger.setLevel(_gunicorn_logger.level)
+else:
+    app.logger.setLevel(logging.INFO)
+# Expose the size headers so browser clients of the binary transport can read them
+CORS(app, expose_headers=['X-Original-File-Size-KB', 'X-Compressed-File-Size-KB', 'X-Compression-Level-Applied', 'ETag'])
 
-@app.route('/')
-def home():
-    """Simple home route to confirm the backend server is running and Ghostscript is available."""
+# Don't echo MuPDF warnings for damaged/scanned files to stderr on every page
+fitz.TOOLS.mupdf_display_errors(False)
+# Plain-text extraction flags, explicitly without image block bookkeeping; ligatures are expanded
+# to their component characters, which is what a plain text dump wants anyway
+_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES & ~fitz.TEXT_PRESERVE_LIGATURES
+
+# Resolve Ghostscript once so no request pays for a PATH search; if it's missing, keep the bare
+# name so the failure still surfaces as "No such file or directory".
+_GS_PATH = shutil.which('gs') or 'gs'
+
+# Ghostscript spools a PDF read from stdin to a temp file before processing it. When the inputs of
+# the Ghostscript processes started together total up to _GS_SHM_MAX_BYTES, those spools go to
+# RAM-backed /dev/shm (or PDF_TMPDIR) instead of a possibly disk-backed /tmp; larger ones stay in
+# the default temp dir, as container /dev/shm is often small.
+_GS_SHM_TMPDIR = os.environ.get('PDF_TMPDIR', '/dev/shm')
+_GS_SHM_ENV = {**os.environ, 'TMPDIR': _GS_SHM_TMPDIR} if os.access(_GS_SHM_TMPDIR, os.W_OK) else None
+_GS_SHM_MAX_BYTES = 16 * 1024 * 1024
+# Ghostscript stderr fragments that point at its temp files rather than at the PDF
+_GS_SPOOL_ERRORS = (b'No space left', b'ioerror', b'temporary file')
+
+# Base Ghostscript command, shared by every compression level
+_GS_BASE = (
+    _GS_PATH,
+    '-sDEVICE=pdfwrite',        # Output device is PDF writer
+    '-dCompatibilityLevel=1.4', # For broader compatibility
+    '-dNOPAUSE',                # Do not pause for errors/prompts
+    '-dQUIET',                  # Suppress verbose output
+    '-dBATCH',                  # Exit after processing
+    '-dSAFER',                  # Enable safer mode for file operations
+    '-dEmbedAllFonts=true',     # Default: Embed all fonts
+    '-dSubsetFonts=true',       # Default: Subset fonts
+    '-dCompressFonts=true',     # Default: Compress font data
+    '-dOptimize=true',          # Default: General PDF optimization
+    '-dDetectDuplicateImages=true', # Default: Detect and remove duplicate images
+    '-dDownsampleColorImages=true', # Always downsample images above the level's target resolution,
+    '-dDownsampleGrayImages=true',  # so the JPEG encoder never processes more pixels than
+    '-dDownsampleMonoImages=true',  # will actually be kept
+    '-dPassThroughJPEGImages=true', # Copy JPEGs that need no resampling or colour conversion as-is
+    '-dAutoRotatePages=/None',  # Keep page orientation as-is; skips per-page text orientation analysis
+)
+
+# Every gunicorn worker has its own background pools, so their sizes come from the cores left to
+# each worker (WEB_CONCURRENCY, defaulting to the Procfile's 1 per core), never below 1.
+_WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1)
+_CORES_PER_WORKER = max(1, (os.cpu_count() or 1) // _WEB_WORKERS)
+
+# Documents with at least this many pages have their text extracted by up to _TEXT_POOL_SIZE
+# processes (PDF_TEXT_WORKERS), each handling a contiguous page range of at least
+# _TEXT_MIN_PAGES_PER_WORKER pages; with a pool size of 1 text is always extracted in-process.
+# Long documents are rare and their extraction short, so on multi-core machines the default allows
+# 2 processes per worker even where that briefly oversubscribes the cores.
+_TEXT_PARALLEL_MIN_PAGES = 64
+_TEXT_MIN_PAGES_PER_WORKER = 32
+_TEXT_POOL_SIZE = int(os.environ.get('PDF_TEXT_WORKERS') or max(_CORES_PER_WORKER, min(2, os.cpu_count() or 1)))
+_text_executor = None
+_text_executor_lock = threading.Lock()
+
+# With PDF_GS_SHARDING=1, PDFs with at least this many pages are compressed by several Ghostscript
+# processes at once, each handling a contiguous page range of at least _GS_MIN_PAGES_PER_SHARD pages.
+# Shorter shards lose more to per-process startup and the merge than they gain in parallelism.
+# Stitching the ranges back together re-embeds shared fonts once per range, so it's opt-in.
+_GS_SHARDING = os.environ.get('PDF_GS_SHARDING') == '1'
+_GS_SHARD_MIN_PAGES = 50
+_GS_MIN_PAGES_PER_SHARD = 25
+
+# Compressed results are cached on disk, keyed by the BLAKE3 digest of the upload, the level and
+# the settings version (see _get_cache_version), so every gunicorn worker shares them. The oldest
+# entries are evicted beyond _CACHE_MAX_BYTES; to avoid a directory scan on every write, each
+# worker only checks after writing another _CACHE_SWEEP_BYTES, so the bound is approximate.
+_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'pdf-compress-cache'))
+_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_MB', '512')) * 1024 * 1024
+_CACHE_SWEEP_BYTES = _CACHE_MAX_BYTES // 64
+# Bump whenever the way a PDF's compression is chosen changes (e.g. _has_images or the pikepdf
+# route), so results produced by the old logic stop being served
+_CACHE_LOGIC_VERSION = 1
+_cache_version = None
+# Start "due", so each worker's first write checks the bound
+_cache_bytes_since_sweep = _CACHE_SWEEP_BYTES
+# Uploads larger than this are never cached; one of them could otherwise flush most of the cache
+_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('PDF_CACHE_MAX_ENTRY_MB', '100')) * 1024 * 1024
+
+# Background compression jobs (/compress-pdf-async) keep their input, state and result as files,
+# so queued jobs hold no upload in memory and the poll for a result can land on any gunicorn worker.
+# Jobs are pruned after _JOB_TTL_SECONDS. A job still pending after _JOB_MAX_RUNTIME_SECONDS, or
+# whose worker process is gone, is reported as failed. Each worker runs _CORES_PER_WORKER jobs at
+# once and queues at most _JOB_MAX_PENDING; beyond that the endpoint answers 503.
+# Jobs run inside the web worker that accepted them. When gunicorn recycles that worker
+# (--max-requests, which polls count towards too), it stops taking requests and finishes its
+# queued jobs, but the arbiter kills it once it has been silent for --timeout seconds; jobs still
+# running then are reported as interrupted and have to be resubmitted.
+_JOB_DIR = os.environ.get('PDF_JOB_DIR', os.path.join(tempfile.gettempdir(), 'pdf-compress-jobs'))
+_JOB_TTL_SECONDS = 3600
+_JOB_MAX_RUNTIME_SECONDS = 900
+_JOB_MAX_PENDING = 4 * _CORES_PER_WORKER
+_job_slots = threading.BoundedSemaphore(_JOB_MAX_PENDING)
+_HOSTNAME = socket.gethostname()
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+# Per-level Ghostscript settings, built once at import and selected by dict lookup per request.
+# Leveraging -dPDFSETTINGS as a BASELINE, then explicitly overriding for fine-tuning.
+_GS_LEVEL_ARGS = {
+    # EXTREME COMPRESSION: Force grayscale, very low resolution and quality.
+    'extreme': (
+        '-sProcessColorModel=DeviceGray', # *** CRITICAL: Convert ALL colors to grayscale ***
+        '-sColorConversionStrategy=Gray', # Convert every image/colour space to gray once, inside pdfwrite
+        '-dPDFSETTINGS=/screen',        # Base preset for smallest size (72dpi)
+        '-dColorImageResolution=50',    # Explicitly low resolution for color (now gray)
+        '-dGrayImageResolution=50',     # Explicitly low resolution for grayscale
+        '-dMonoImageResolution=72',     # Low resolution for monochrome
+        '-dColorImageQuality=5',        # Very low JPEG quality for color (now gray)
+        '-dGrayImageQuality=5',         # Very low JPEG quality for grayscale
+        '-dColorImageDownsampleType=/Average', # Fastest, most aggressive downsampling
+        '-dGrayImageDownsampleType=/Average',
+        '-dMonoImageDownsampleType=/Average',
+        '-dColorImageDownsampleThreshold=1.0', # Downsample anything above the target resolution
+        '-dGrayImageDownsampleThreshold=1.0',
+        '-dMonoImageDownsampleThreshold=1.0',
+        '-dEmbedAllFonts=false',        # Try not to embed all fonts for max size reduction
+        '-dMaxSubsetPct=10',            # Aggressive font subsetting
+        '-sOptimizeForBookmarks=false', 
+        '-sPreserveHalftoneInfo=false', 
+        '-sPreserveOverprint=false',
+    ),
+    # LESS COMPRESSION: High quality, moderate reduction.
+    'less': (
+        '-dPDFSETTINGS=/printer',       # Base preset for high quality (300dpi)
+        '-dColorImageResolution=300',   # High resolution for color
+        '-dGrayImageResolution=300',    # High resolution for grayscale
+        '-dMonoImageResolution=600',    # High resolution for monochrome
+        '-dColorImageQuality=80',       # High JPEG quality
+        '-dGrayImageQuality=80',
+        '-dColorImageDownsampleType=/Bicubic', # High quality downsampling
+        '-dGrayImageDownsampleType=/Bicubic',
+        '-dMonoImageDownsampleType=/Bicubic',
+        '-dColorImageDownsampleThreshold=1.5', # Leave images up to 450dpi alone so existing JPEGs
+        '-dGrayImageDownsampleThreshold=1.5',  # pass through instead of being re-encoded at high quality
+        '-dMonoImageDownsampleThreshold=1.5',
+        '-dMaxSubsetPct=100',           # Full font subsetting
+    ),
+    # RECOMMENDED COMPRESSION: Balanced quality and size.
+    'recommended': (
+        '-dPDFSETTINGS=/ebook',         # Base preset for balanced size (150dpi)
+        '-dColorImageResolution=150',   # Moderate resolution for color
+        '-dGrayImageResolution=150',    # Moderate resolution for grayscale
+        '-dMonoImageResolution=300',    # Standard resolution for monochrome
+        '-dColorImageQuality=40',       # Medium JPEG quality
+        '-dGrayImageQuality=40',
+        '-dColorImageDownsampleType=/Bicubic',
+        '-dGrayImageDownsampleType=/Bicubic',
+        '-dMonoImageDownsampleType=/Bicubic',
+        '-dColorImageDownsampleThreshold=1.0', # Downsample anything above the target resolution
+        '-dGrayImageDownsampleThreshold=1.0',
+        '-dMonoImageDownsampleThreshold=1.0',
+        '-dMaxSubsetPct=50',            # Moderate font subsetting
+    ),
+}
+
+# Text/vector-only PDFs get the same settings minus every image-specific switch, so pdfwrite
+# doesn't set up its image sampling pipeline for nothing (see _has_images).
+_GS_TEXT_ONLY_LEVEL_ARGS = {
+    level: tuple(arg for arg in args if 'Image' not in arg) for level, args in _GS_LEVEL_ARGS.items()
+}
+_GS_TEXT_ONLY_BASE = (_GS_PATH, *(arg for arg in _GS_BASE[1:] if 'Image' not in arg))
+# Inline image operator (BI ... ID ... EI) in a content stream
+_INLINE_IMAGE_RE = re.compile(rb'(?:^|\s)BI\s')
+
+# Output and input go last: Ghostscript applies switches in order, so any setting placed
+# after the input file would only take effect once the document had already been processed.
+# The PDF is piped through stdin/stdout instead of round-tripping through temp files.
+_GS_PIPE_ARGS = (
+    '-sstdout=%stderr',         # Keep interpreter messages out of the PDF written to stdout
+    '-sOutputFile=-',           # Write the compressed PDF to stdout
+    '-',                        # Read the input PDF from stdin
+)
+
+# Raw bytes per base64 chunk when streaming a JSON body; a multiple of 3 so chunks concatenate cleanly
+_B64_STREAM_CHUNK = 48000
+
+def _base64_json_chunks(payload, field, data):
+    """
+    Encode `payload` plus `data` base64-encoded under `field` as one JSON object, chunk by chunk.
+    Returns (length, chunks): the encoded length and a generator that encodes as it's consumed.
+    """
+    head = orjson.dumps(payload)[:-1] + f',"{field}":"'.encode()
+
+    def generate():
+        yield head
+        view = memoryview(data)
+        for offset in range(0, len(data), _B64_STREAM_CHUNK):
+            yield pybase64.b64encode(view[offset:offset + _B64_STREAM_CHUNK])
+        yield b'"}'
+
+    return len(head) + 4 * ((len(data) + 2) // 3) + 2, generate()
+
+def _stream_base64_json(payload, field, data):
+    """
+    Stream `payload` plus `data` base64-encoded under `field` as one JSON object, encoding chunk by
+    chunk as the client reads instead of materializing the base64 string and the JSON document.
+    """
+    # The encoded length is known up front, so clients still get a Content-Length
+    content_length, chunks = _base64_json_chunks(payload, field, data)
+    return Response(chunks, mimetype='application/json', headers={'Content-Length': str(content_length)})
+
+def _run_ghostscript(ghostscript_command, pdf_bytes, spool_bytes=None):
+    """
+    Run Ghostscript with the PDF on stdin and return the PDF it writes to stdout.
+    spool_bytes is the total input of all the Ghostscript processes started together with this
+    one (default: just this input); they only spool to /dev/shm if that total fits under
+    _GS_SHM_MAX_BYTES and, with room for Ghostscript's own temp files, in its free space.
+    """
+    # Per-request INFO lines use lazy %-formatting; the joined command is only built when it will be logged
+    if app.logger.isEnabledFor(logging.INFO):
+        app.logger.info("Final Ghostscript command being executed: %s", ' '.join(ghostscript_command))
+
+    # Execute Ghostscript, feeding the PDF on stdin and collecting the result from stdout
+    spool_bytes = spool_bytes or len(pdf_bytes)
+    env = None
+    if _GS_SHM_ENV is not None and spool_bytes <= _GS_SHM_MAX_BYTES:
+        shm_stats = os.statvfs(_GS_SHM_TMPDIR)
+        if shm_stats.f_bavail * shm_stats.f_frsize >= 2 * spool_bytes:
+            env = _GS_SHM_ENV
+    result = subprocess.run(ghostscript_command, input=pdf_bytes, capture_output=True, check=False, env=env)
+    if result.returncode != 0 and env is not None and any(error in result.stderr for error in _GS_SPOOL_ERRORS):
+        # /dev/shm can still fill up under concurrent requests; retry once in the default temp dir.
+        # Failures caused by the PDF itself are not retried, they would only fail again.
+        app.logger.warning("Ghostscript failed with its temp files in %s; retrying in the default temp dir.", _GS_SHM_TMPDIR)
+        result = subprocess.run(ghostscript_command, input=pdf_bytes, capture_output=True, check=False)
+
+    if result.returncode != 0:
+        ghostscript_error = result.stderr.decode('utf-8', 'replace').strip()
+        app.logger.error(f"Ghostscript compression failed (Return Code: {result.returncode}): {ghostscript_error}")
+        if ghostscript_error:
+            # Include a more informative error for the user
+            raise Exception(f"PDF compression failed: Ghostscript reported: {ghostscript_error}")
+        else:
+            raise Exception(f"PDF compression failed with exit code {result.returncode}. No detailed error from Ghostscript.")
+
+    return result.stdout
+
+def _recompress_with_pikepdf(pdf_bytes):
+    """Losslessly rewrite a PDF with qpdf: recompress every stream and pack objects into object streams."""
+    output = io.BytesIO()
+    with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+        pdf.save(output, compress_streams=True, recompress_flate=True,
+                 stream_decode_level=pikepdf.StreamDecodeLevel.generalized,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    return output.getvalue()
+
+def _has_images(doc):
+    """
+    Whether doc contains any raster image: an image XObject anywhere in the file, an inline image
+    in a page, form or pattern content stream, or a Type 3 font (whose glyphs are often inline
+    bitmaps). Anything that can't be checked counts as having images, which keeps the full settings.
+    """
+    try:
+        for xref in range(1, doc.xref_length()):
+            subtype = doc.xref_get_key(xref, 'Subtype')[1]
+            if subtype in ('/Image', '/Type3'):
+                return True
+            if subtype == '/Form' or doc.xref_get_key(xref, 'PatternType')[0] != 'null':
+                if _INLINE_IMAGE_RE.search(doc.xref_stream(xref) or b''):
+                    return True
+        return any(_INLINE_IMAGE_RE.search(page.read_contents()) for page in doc)
+    except Exception:
+        return True
+
+def _can_shard(doc):
+    """
+    Whether doc survives being compressed in page ranges. The merge only carries over pages, the
+    outline and the info dictionary, so link annotations (which may point across ranges), forms,
+    named destinations, page labels and other catalog-level structure all rule it out.
+    """
+    catalog = doc.pdf_catalog()
+    for key in ('AcroForm', 'Names', 'Dests', 'PageLabels', 'StructTreeRoot', 'OCProperties'):
+        if doc.xref_get_key(catalog, key)[0] != 'null':
+            return False
+    return not any(page.first_link for page in doc)
+
+def _compress_pdf_bytes(pdf_bytes, settings_level, allow_sharding=True):
+    """
+    Compress a PDF at settings_level, with Ghostscript or, where that can't help, pikepdf.
+
+    At 'less', a PDF that _has_images finds no images in has nothing for Ghostscript to resample,
+    so it gets a (much faster) lossless pikepdf rewrite instead. Every other PDF goes through
+    Ghostscript, with the text-only settings when it has no images.
+    pdfwrite is single-threaded, so with sharding enabled, long documents without cross-page
+    structure are split into page ranges that are compressed by concurrent Ghostscript processes
+    and then stitched back together in order. Callers that already run several compressions at
+    once pass allow_sharding=False to keep the number of Ghostscript processes bounded.
+    """
+    # Documents are opened as context managers so they're released even if a damaged PDF raises
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = len(doc)
+        toc = doc.get_toc(simple=False)
+        metadata = doc.metadata
+        has_images = _has_images(doc)
+
+        shards = min(os.cpu_count() or 1, page_count // _GS_MIN_PAGES_PER_SHARD)
+        if not (_GS_SHARDING and allow_sharding) or page_count < _GS_SHARD_MIN_PAGES or shards < 2 or not _can_shard(doc):
+            shards = 1
+        bounds = [page_count * i // shards for i in range(shards + 1)]
+        shard_inputs = []
+        if shards > 1:
+            # Each Ghostscript process gets only its own page range instead of the whole document
+            for start, stop in zip(bounds, bounds[1:]):
+                with fitz.open() as shard_doc:
+                    shard_doc.insert_pdf(doc, from_page=start, to_page=stop - 1)
+                    shard_inputs.append(shard_doc.tobytes())
+
+    if settings_level == 'less' and not has_images:
+        app.logger.info("No images found; recompressing losslessly with pikepdf instead of Ghostscript.")
+        return _recompress_with_pikepdf(pdf_bytes)
+
+    if has_images:
+        gs_prefix = (*_GS_BASE, *_GS_LEVEL_ARGS[settings_level])
+    else:
+        app.logger.info("No images found; using text-only Ghostscript settings.")
+        gs_prefix = (*_GS_TEXT_ONLY_BASE, *_GS_TEXT_ONLY_LEVEL_ARGS[settings_level])
+    ghostscript_command = [*gs_prefix, *_GS_PIPE_ARGS]
+
+    if shards == 1:
+        return _run_ghostscript(ghostscript_command, pdf_bytes)
+
+    app.logger.info("Compressing %d pages in %d parallel Ghostscript page ranges.", page_count, shards)
+    # Threads are enough here: each one just waits on its own Ghostscript process
+    spool_bytes = sum(len(shard) for shard in shard_inputs)
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        compressed_parts = list(executor.map(
+            lambda shard: _run_ghostscript(ghostscript_command, shard, spool_bytes), shard_inputs))
+
+    with fitz.open() as merged:
+        for part in compressed_parts:
+            with fitz.open(stream=part, filetype="pdf") as part_doc:
+                merged.insert_pdf(part_doc)
+        # Page ranges lose the document-level outline and info dictionary; restore them from the original
+        merged.set_toc(toc)
+        merged.set_metadata(metadata)
+        merged_bytes = merged.tobytes(garbage=3, deflate=True)
+
+    # Fonts shared across ranges are embedded once per range; if that ate the savings, a single
+    # pass over the whole document does better
+    if len(merged_bytes) >= len(pdf_bytes):
+        app.logger.info("Page-range output is not smaller than the input; compressing in a single pass.")
+        return _run_ghostscript(ghostscript_command, pdf_bytes)
+    return merged_bytes
+
+def _get_cache_version():
+    """
+    Short digest of everything besides the upload and level that determines a compression result:
+    the Ghostscript arguments, the Ghostscript and pikepdf versions and _CACHE_LOGIC_VERSION.
+    """
+    global _cache_version
+    if _cache_version is not None:
+        return _cache_version
+    try:
+        ghostscript_version = subprocess.run([_GS_PATH, '--version'], capture_output=True, text=True,
+                                             check=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        ghostscript_version = None # Not remembered, so the version is picked up once gs works
+    settings = orjson.dumps([_CACHE_LOGIC_VERSION, ghostscript_version, pikepdf.__version__,
+                             _GS_BASE[1:], _GS_LEVEL_ARGS, _GS_TEXT_ONLY_BASE[1:],
+                             _GS_TEXT_ONLY_LEVEL_ARGS, _GS_PIPE_ARGS])
+    version = blake3.blake3(settings).hexdigest()[:16]
+    if ghostscript_version is not None:
+        _cache_version = version
+    return version
+
+def _cache_key(pdf_bytes, settings_level):
+    """
+    Cache key for a compression result: content digest plus the settings level and settings
+    version applied. It also serves as the weak ETag of JSON responses. BLAKE3 hashes large
+    uploads on all cores with SIMD.
+    """
+    digest = blake3.blake3(pdf_bytes, max_threads=blake3.blake3.AUTO).hexdigest()
+    return f"{digest}_{settings_level}_{_get_cache_version()}"
+
+def _cache_get(cache_key):
+    """Return the cached compressed PDF for cache_key, or None on a miss."""
+    cache_path = os.path.join(_CACHE_DIR, f"{cache_key}.pdf")
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cached_bytes = cache_file.read()
+        # Touch the entry so eviction removes the least recently used files first
+        os.utime(cache_path)
+        return cached_bytes
+    except OSError:
+        return None
+
+def _write_atomic(path, data):
+    """Write data to a private temp file and rename it into place, so concurrent readers never see partial files."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Don't leave a partial temp file behind (e.g. after ENOSPC)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _cache_put(cache_key, compressed_pdf_bytes):
+    """Store a compressed PDF under cache_key and, every _CACHE_SWEEP_BYTES written, evict the oldest entries beyond the size bound."""
+    global _cache_bytes_since_sweep
+    try:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        _write_atomic(os.path.join(_CACHE_DIR, f"{cache_key}.pdf"), compressed_pdf_bytes)
+
+        _cache_bytes_since_sweep += len(compressed_pdf_bytes)
+        if _cache_bytes_since_sweep < _CACHE_SWEEP_BYTES:
+            return
+        _cache_bytes_since_sweep = 0
+
+        entries = []
+        for entry in os.scandir(_CACHE_DIR):
+            try:
+                if entry.name.endswith('.pdf'):
+                    entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except FileNotFoundError:
+                pass # Evicted by another worker mid-scan
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= _CACHE_MAX_BYTES:
+                break
+            total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    except OSError as e:
+        # The cache is an optimization only; a full or read-only disk must not fail the request
+        app.logger.warning(f"Could not update the compression cache: {e}")
+
+def _compress_single(pdf_bytes, settings_level, allow_sharding=True):
+    """
+    Compress one PDF at settings_level, serving and filling the result cache.
+    allow_sharding is passed on to _compress_pdf_bytes.
+    Returns (compressed_pdf_bytes, cache_key); the result is never larger than the input.
+    """
+    cache_key = _cache_key(pdf_bytes, settings_level)
+    compressed_pdf_bytes = _cache_get(cache_key)
+    if compressed_pdf_bytes is not None:
+        app.logger.info("Serving cached %s compression result.", settings_level.upper())
+        return compressed_pdf_bytes, cache_key
+
+    app.logger.info("Applying %s compression settings.", settings_level.upper())
+    compressed_pdf_bytes = _compress_pdf_bytes(pdf_bytes, settings_level, allow_sharding)
+
+    if len(compressed_pdf_bytes) >= len(pdf_bytes):
+        # Already well-optimized files (typically at 'less') can come out larger after a rewrite;
+        # never hand back something bigger than what was uploaded.
+        app.logger.info("Compressed output is not smaller than the input; returning the original PDF.")
+        compressed_pdf_bytes = pdf_bytes
+
+    if len(pdf_bytes) <= _CACHE_MAX_ENTRY_BYTES:
+        _cache_put(cache_key, compressed_pdf_bytes)
+    return compressed_pdf_bytes, cache_key
+
+def _settings_level(compression_level_hint):
+    """Settings level for a requested compressionLevel; anything unsupported (even a non-string) gets 'recommended'."""
+    if isinstance(compression_level_hint, str) and compression_level_hint in _GS_LEVEL_ARGS:
+        return compression_level_hint
+    return 'recommended'
+
+def _compressed_filename(original_filename, compression_level_hint):
+    """Output filename, including the compression level for easy identification."""
+    name, ext = os.path.splitext(original_filename)
+    return f"{name}_compressed_{compression_level_hint}{ext}"
+
+def _get_job_executor():
+    """Return the thread pool running background compression jobs, creating it on first use."""
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=_CORES_PER_WORKER)
+        return _job_executor
+
+def _job_path(job_id, suffix):
+    """Path of a job's state (.json), spooled input (.input.pdf) or result (.pdf) file."""
+    return os.path.join(_JOB_DIR, f"{job_id}{suffix}")
+
+def _write_job_state(job_id, state):
+    """Atomically replace a job's state file."""
+    _write_atomic(_job_path(job_id, '.json'), orjson.dumps(state))
+
+def _process_start_time(pid):
+    """Start time of process pid in clock ticks since boot, or None if it isn't running (or there's no /proc)."""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as stat_file:
+            # Field 22; the command name (field 2) may itself contain spaces, so split after it
+            return int(stat_file.read().rpartition(b')')[2].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _job_is_orphaned(state):
+    """Whether a pending job will never finish: it's past _JOB_MAX_RUNTIME_SECONDS or its worker is gone."""
+    if time.time() - state.get('queuedAt', 0) > _JOB_MAX_RUNTIME_SECONDS:
+        return True
+    if state.get('host') != _HOSTNAME:
+        return False # Another host's processes can't be checked; only the runtime limit applies
+    # Comparing start times as well catches the pid having been reused by a new process
+    return _process_start_time(state['pid']) != state['pidStartTime']
+
+def _prune_jobs():
+    """Delete jobs older than _JOB_TTL_SECONDS, removing a job's state, input and result files together."""
+    cutoff = time.time() - _JOB_TTL_SECONDS
+    try:
+        for entry in os.scandir(_JOB_DIR):
+            job_id, _, suffix = entry.name.partition('.')
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if suffix == 'json':
+                    for job_suffix in ('.json', '.input.pdf', '.pdf'):
+                        try:
+                            os.remove(_job_path(job_id, job_suffix))
+                        except FileNotFoundError:
+                            pass
+                elif not os.path.exists(_job_path(job_id, '.json')):
+                    os.remove(entry.path) # Left behind by an interrupted job or write
+            except FileNotFoundError:
+                pass # Already pruned by another worker
+    except OSError as e:
+        # Pruning is housekeeping only; it must not fail the request that triggered it
+        app.logger.warning(f"Could not prune old compression jobs: {e}")
+
+def _run_compress_job(job_id, settings_level, compression_level_hint, original_filename):
+    """Compress a queued PDF from its spooled input and record the result (or the failure) in the job directory."""
+    input_path = _job_path(job_id, '.input.pdf')
+    try:
+        with open(input_path, 'rb') as input_file:
+            pdf_bytes = input_file.read()
+        # Other jobs and requests share the cores, so no page-range sharding on top
+        compressed_pdf_bytes, _ = _compress_single(pdf_bytes, settings_level, allow_sharding=False)
+        _write_atomic(_job_path(job_id, '.pdf'), compressed_pdf_bytes)
+        _write_job_state(job_id, {
+            'status': 'done',
+            'fileName': _compressed_filename(original_filename, compression_level_hint),
+            'originalSize': len(pdf_bytes) / 1024,
+            'compressedSize': len(compressed_pdf_bytes) / 1024,
+            'compressionLevelApplied': compression_level_hint
+        })
+    except Exception as e:
+        app.logger.error(f"Error in compression job {job_id}: {e}", exc_info=True)
+        try:
+            _write_job_state(job_id, {'status': 'failed', 'error': f"Failed to compress PDF: {str(e)}"})
+        except OSError:
+            pass # The poll reports the job as failed once it's orphaned
+    finally:
+        try:
+            os.remove(input_path)
+        except OSError:
+            pass
+        _job_slots.release()
+
+def _get_text_executor():
+    """
+    Return the process pool used for parallel text extraction, creating it on first use so
+    every gunicorn worker gets its own. PyMuPDF is not thread-safe, hence processes; they are
+    started via forkserver because forking a threaded worker process is unsafe.
+    """
+    global _text_executor
+    with _text_executor_lock:
+        if _text_executor is None:
+            _text_executor = ProcessPoolExecutor(max_workers=_TEXT_POOL_SIZE,
+                                                 mp_context=multiprocessing.get_context('forkserver'))
+        return _text_executor
+
+def _extract_text_range(pdf_bytes, start, stop):
+    """Extract the plain text of pages [start, stop). Runs in a text extraction worker."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        # Collect per-page text and join once; repeated += copies the growing string every page
+        parts = [doc[page_num].get_text("text", flags=_TEXT_FLAGS) for page_num in range(start, stop)]
+    return "".join(parts)
+
+def _extract_text(pdf_bytes):
+    """Extract the plain text of a whole PDF, splitting long documents across processes."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = len(doc)
+
+    workers = min(_TEXT_POOL_SIZE, page_count // _TEXT_MIN_PAGES_PER_WORKER)
+    if page_count < _TEXT_PARALLEL_MIN_PAGES or workers < 2:
+        return _extract_text_range(pdf_bytes, 0, page_count)
+
+    # Each range pickles its own copy of pdf_bytes to its process, so there are never more
+    # copies in flight than processes in the pool
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    futures = [_get_text_executor().submit(_extract_text_range, pdf_bytes, start, stop)
+               for start, stop in zip(bounds, bounds[1:])]
+    return "".join(future.result() for future in futures)
+
+# Multipart field names accepted for the uploaded PDF, in order of preference
+_UPLOAD_FIELDS = ('pdf_file', 'pdf', 'file')
+
+# PDFs larger than MAX_PDF_BYTES (unset: no limit) are rejected with 413 before any processing;
+# request bodies are capped to match, so oversized uploads aren't even read into memory.
+_MAX_PDF_BYTES = int(os.environ.get('MAX_PDF_BYTES', '0')) or None
+# Readers accept a PDF header preceded by up to 1 KB of junk, so look for it that far in
+_PDF_HEADER_WINDOW = 1024
+
+# /compress-pdf-batch takes at most this many files per request; with MAX_PDF_BYTES set, its body
+# is capped at that many base64 encoded maximum-size PDFs (plus room for the other JSON fields).
+_BATCH_MAX_ITEMS = 16
+_BATCH_MAX_BODY_BYTES = _BATCH_MAX_ITEMS * (4 * ((_MAX_PDF_BYTES + 2) // 3) + 4096) if _MAX_PDF_BYTES else None
+
+def _check_pdf(pdf_bytes):
+    """Return an error response for an upload that is too large or not a PDF, else None."""
+    if _MAX_PDF_BYTES and len(pdf_bytes) > _MAX_PDF_BYTES:
+        return jsonify({'error': f'PDF is larger than the {_MAX_PDF_BYTES} byte limit'}), 413
+    if b'%PDF-' not in pdf_bytes[:_PDF_HEADER_WINDOW]:
+        return jsonify({'error': 'Uploaded data is not a PDF'}), 400
+    return None
+
+# Hosts a JSON body's `pdfUrl` (e.g. a signed S3 URL) may point at, comma-separated. Unset disables
+# URL uploads, so the service can't be used to reach arbitrary (internal) addresses.
+_PDF_URL_ALLOWED_HOSTS = frozenset(host.strip().lower() for host in
+                                   os.environ.get('PDF_URL_ALLOWED_HOSTS', '').split(',') if host.strip())
+# Downloads are capped at MAX_PDF_BYTES (or _PDF_URL_DEFAULT_MAX_BYTES when that's unset) and must
+# finish within _PDF_URL_DEADLINE_SECONDS in total; the per-read socket timeout alone would let a
+# server trickling bytes hold the request open indefinitely.
+_PDF_URL_TIMEOUT_SECONDS = 10
+_PDF_URL_DEADLINE_SECONDS = 60
+_PDF_URL_DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+_PDF_URL_MAX_BYTES = _MAX_PDF_BYTES or _PDF_URL_DEFAULT_MAX_BYTES
+_PDF_URL_READ_CHUNK = 1024 * 1024
+# Content types a PDF download may be served with (object stores often use a generic binary type)
+_PDF_URL_CONTENT_TYPES = frozenset({'application/pdf', 'application/x-pdf', 'application/octet-stream', 'binary/octet-stream'})
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Refuse redirects; following one could lead off the allowed hosts."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+_pdf_url_opener = urllib.request.build_opener(_NoRedirectHandler)
+
+def _fetch_pdf_url(pdf_url):
+    """Download a PDF from an https URL on one of _PDF_URL_ALLOWED_HOSTS."""
+    parsed_url = urllib.parse.urlsplit(pdf_url) if isinstance(pdf_url, str) else None
+    if not parsed_url or parsed_url.scheme != 'https' or (parsed_url.hostname or '').lower() not in _PDF_URL_ALLOWED_HOSTS:
+        raise BadRequest('pdfUrl must be an https URL on an allowed host')
+    try:
+        deadline = time.monotonic() + _PDF_URL_DEADLINE_SECONDS
+        with _pdf_url_opener.open(pdf_url, timeout=_PDF_URL_TIMEOUT_SECONDS) as response:
+            content_type = response.headers.get('Content-Type')
+            if content_type and content_type.split(';')[0].strip().lower() not in _PDF_URL_CONTENT_TYPES:
+                raise BadRequest(f'pdfUrl is not a PDF (Content-Type: {content_type})')
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > _PDF_URL_MAX_BYTES:
+                raise BadRequest(f'pdfUrl is larger than the {_PDF_URL_MAX_BYTES} byte limit')
+
+            chunks = []
+            received_bytes = 0
+            # read1 returns whatever one socket read delivers, so the deadline is checked as bytes trickle in
+            while chunk := response.read1(_PDF_URL_READ_CHUNK):
+                received_bytes += len(chunk)
+                if received_bytes > _PDF_URL_MAX_BYTES:
+                    raise BadRequest(f'pdfUrl is larger than the {_PDF_URL_MAX_BYTES} byte limit')
+                if time.monotonic() > deadline:
+                    raise BadRequest(f'Could not fetch pdfUrl within {_PDF_URL_DEADLINE_SECONDS} seconds')
+                chunks.append(chunk)
+            return b''.join(chunks)
+    except OSError as e:
+        raise BadRequest(f'Could not fetch pdfUrl: {e}')
+
+def _read_pdf_upload(endpoint):
+    """
+    Read the uploaded PDF from the current request.
+
+    Accepts a `multipart/form-data` upload (file in any of _UPLOAD_FIELDS, options as form fields), a raw
+    `application/pdf` body (options such as fileName are passed in the query string) or a
+    JSON body carrying the PDF in `pdfFileBase64` (legacy) or referencing it by `pdfUrl`.
+    Returns a (pdf_bytes, options, raw_transport) tuple; pdf_bytes is None if no PDF was sent.
+    """
+    if _MAX_PDF_BYTES:
+        # Raw bodies are the PDF itself; base64 is 4/3 larger, plus room for the other fields
+        request.max_content_length = (_MAX_PDF_BYTES if request.mimetype == 'application/pdf'
+                                      else _MAX_PDF_BYTES * 4 // 3 + 64 * 1024)
+
+    if request.mimetype == 'multipart/form-data':
+        pdf_file = next((request.files[field] for field in _UPLOAD_FIELDS if field in request.files), None)
+        if pdf_file is None:
+            return None, None, True
+        # The uploaded file's own name is the default, an explicit fileName field wins
+        options = {'fileName': pdf_file.filename or 'document.pdf', **request.form.to_dict()}
+        return pdf_file.read() or None, options, True
+
+    if request.mimetype == 'application/pdf':
+        # Binary transport: no base64 decode and no 33% payload inflation
+        return request.get_data(cache=False) or None, request.args, True
+
+    if not request.is_json:
+        return None, None, False
+
+    # Parsed with orjson rather than the stdlib decoder behind get_json(); the body is dominated
+    # by one multi-MB base64 string. The raw body isn't cached on the request, so popping that
+    # string below leaves the decoded bytes as the only full copy of the PDF in memory.
+    data = orjson.loads(request.get_data(cache=False))
+    if not isinstance(data, dict) or ('pdfFileBase64' not in data and 'pdfUrl' not in data):
+        return None, None, False
+
+    if 'pdfFileBase64' not in data:
+        return _fetch_pdf_url(data.pop('pdfUrl')) or None, data, False
+
+    app.logger.info("JSON/base64 upload to %s is deprecated; send the PDF as an application/pdf body instead.", endpoint)
+    pdf_bytes = pybase64.b64decode(data.pop('pdfFileBase64'), validate=True)
+    return pdf_bytes, data, False
+
+def _probe_ghostscript():
+    """Check once whether Ghostscript is available and describe it for the home route."""
     try:
         # Check if 'gs' (Ghostscript) command is available
-        result = subprocess.run(['gs', '--version'], capture_output=True, text=True, check=True, timeout=5)
+        result = subprocess.run([_GS_PATH, '--version'], capture_output=True, text=True, check=True, timeout=5)
         ghostscript_version_line = next((line for line in result.stdout.splitlines() if "Ghostscript" in line), "Unknown version")
-        ghostscript_status = f"Ghostscript is installed and available. {ghostscript_version_line}"
+        return f"Ghostscript is installed and available. {ghostscript_version_line}"
     except Exception as e:
-        ghostscript_status = f"Ghostscript is NOT available. Error: {e}. Ensure it's installed via build.sh"
         app.logger.error(f"Ghostscript availability check failed: {e}")
+        return f"Ghostscript is NOT available. Error: {e}. Ensure it's installed via build.sh"
 
-    return f"PDF Processing Backend (Ghostscript Tuned Compression) is running! {ghostscript_status}"
+# The Ghostscript install can't change while the process runs, so it's probed once, on the first
+# health check, instead of forking `gs --version` on every one. Probing lazily rather than at import
+# keeps the text extraction processes, which import this module, from running it too.
+_ghostscript_status = None
+
+def _get_ghostscript_status():
+    """Return the cached Ghostscript availability description, probing on first use."""
+    global _ghostscript_status
+    if _ghostscript_status is None:
+        _ghostscript_status = _probe_ghostscript()
+    return _ghostscript_status
+
+# Confirm at startup that the SIMD base64 codec (not its pure-Python fallback) is what got loaded
+app.logger.info("Using pybase64 %s", pybase64.get_version())
+
+@app.route('/')
+def home():
+    """Simple home route to confirm the backend server is running and Ghostscript is available."""
+    return f"PDF Processing Backend (Ghostscript Tuned Compression) is running! {_get_ghostscript_status()}"
 
 @app.route('/compress-pdf', methods=['POST'])
 def compress_pdf():
     """
-    API endpoint to receive a PDF file (base64 encoded), compress it using Ghostscript
-    with granular controls tuned for distinct compression levels, and return the compressed PDF.
+    API endpoint to receive a PDF file (raw or base64 encoded), compress it using Ghostscript
+    with granular controls tuned for distinct compression levels, and return the compressed PDF
+    in the same transport it was uploaded with (JSON uploads can ask for the raw PDF with
+    `?raw=1` or `Accept: application/pdf`).
     """
-    temp_input_path = None
-    temp_output_path = None
     try:
-        data = request.get_json()
-        if not data or 'pdfFileBase64' not in data:
+        pdf_bytes, options, raw_transport = _read_pdf_upload('/compress-pdf')
+        if pdf_bytes is None:
             return jsonify({'error': 'No PDF file data provided'}), 400
+        error_response = _check_pdf(pdf_bytes)
+        if error_response:
+            return error_response
+
+        original_filename = options.get('fileName', 'document.pdf')
+        compression_level_hint = options.get('compressionLevel', 'recommended')
 
-        pdf_file_base64 = data['pdfFileBase64']
-        original_filename = data.get('fileName', 'document.pdf')
-        compression_level_hint = data.get('compressionLevel', 'recommended')
-
-        pdf_bytes = base64.b64decode(pdf_file_base64)
-        
-        # Create temporary input and output files to interact with Ghostscript
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_input_pdf:
-            temp_input_pdf.write(pdf_bytes)
-            temp_input_path = temp_input_pdf.name
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix="_compressed.pdf") as temp_output_pdf:
-            temp_output_pdf.write(b'') # Ensure file is created before passing path
-            temp_output_path = temp_output_pdf.name
-        
         original_size_bytes = len(pdf_bytes)
         original_size_kb = original_size_bytes / 1024
 
-        # Base Ghostscript command construction
-        ghostscript_command = [
-            'gs',
-            '-sDEVICE=pdfwrite',        # Output device is PDF writer
-            '-dCompatibilityLevel=1.4', # For broader compatibility
-            '-dNOPAUSE',                # Do not pause for errors/prompts
-            '-dQUIET',                  # Suppress verbose output
-            '-dBATCH',                  # Exit after processing
-            '-dSAFER',                  # Enable safer mode for file operations
-            '-dEmbedAllFonts=true',     # Default: Embed all fonts
-            '-dSubsetFonts=true',       # Default: Subset fonts
-            '-dCompressFonts=true',     # Default: Compress font data
-            '-dOptimize=true',          # Default: General PDF optimization
-            '-dFastWebView=true',       # Default: Linearize PDF for faster web viewing
-            '-dDetectDuplicateImages=true', # Default: Detect and remove duplicate images
-            f'-sOutputFile={temp_output_path}', # Specify output file path
-            temp_input_path             # Specify input file path
-        ]
-
         # Apply distinct parameters based on the requested compression level.
-        # Leveraging -dPDFSETTINGS as a BASELINE, then explicitly overriding for fine-tuning.
-        if compression_level_hint == 'extreme':
-            # EXTREME COMPRESSION: Force grayscale, very low resolution and quality.
-            app.logger.info("Applying EXTREME compression settings (FORCING GRAYSCALE & LOWEST QUALITY).")
-            ghostscript_command.extend([
-                '-sProcessColorModel=DeviceGray', # *** CRITICAL: Convert ALL colors to grayscale ***
-                '-dPDFSETTINGS=/screen',        # Base preset for smallest size (72dpi)
-                '-dColorImageResolution=50',    # Explicitly low resolution for color (now gray)
-                '-dGrayImageResolution=50',     # Explicitly low resolution for grayscale
-                '-dMonoImageResolution=72',     # Low resolution for monochrome
-                '-dColorImageQuality=5',        # Very low JPEG quality for color (now gray)
-                '-dGrayImageQuality=5',         # Very low JPEG quality for grayscale
-                '-dColorImageDownsampleType=/Average', # Fastest, most aggressive downsampling
-                '-dGrayImageDownsampleType=/Average',
-                '-dMonoImageDownsampleType=/Average',
-                '-dEmbedAllFonts=false',        # Try not to embed all fonts for max size reduction
-                '-dMaxSubsetPct=10',            # Aggressive font subsetting
-                '-sOptimizeForBookmarks=false', 
-                '-sPreserveHalftoneInfo=false', 
-                '-sPreserveOverprint=false',
-            ])
-        elif compression_level_hint == 'less':
-            # LESS COMPRESSION: High quality, moderate reduction.
-            app.logger.info("Applying LESS compression settings.")
-            ghostscript_command.extend([
-                '-dPDFSETTINGS=/printer',       # Base preset for high quality (300dpi)
-                '-dColorImageResolution=300',   # High resolution for color
-                '-dGrayImageResolution=300',    # High resolution for grayscale
-                '-dMonoImageResolution=600',    # High resolution for monochrome
-                '-dColorImageQuality=80',       # High JPEG quality
-                '-dGrayImageQuality=80',
-                '-dColorImageDownsampleType=/Bicubic', # High quality downsampling
-                '-dGrayImageDownsampleType=/Bicubic',
-                '-dMonoImageDownsampleType=/Bicubic',
-                '-dMaxSubsetPct=100',           # Full font subsetting
-            ])
-        else: # 'recommended' or any other unsupported level defaults to recommended
-            # RECOMMENDED COMPRESSION: Balanced quality and size.
-            app.logger.info("Applying RECOMMENDED compression settings.")
-            ghostscript_command.extend([
-                '-dPDFSETTINGS=/ebook',         # Base preset for balanced size (150dpi)
-                '-dColorImageResolution=150',   # Moderate resolution for color
-                '-dGrayImageResolution=150',    # Moderate resolution for grayscale
-                '-dMonoImageResolution=300',    # Standard resolution for monochrome
-                '-dColorImageQuality=40',       # Medium JPEG quality
-                '-dGrayImageQuality=40',
-                '-dColorImageDownsampleType=/Bicubic',
-                '-dGrayImageDownsampleType=/Bicubic',
-                '-dMonoImageDownsampleType=/Bicubic',
-                '-dMaxSubsetPct=50',            # Moderate font subsetting
-            ])
-
-        app.logger.info(f"Final Ghostscript command being executed: {' '.join(ghostscript_command)}")
-        
-        # Execute Ghostscript command and capture output
-        result = subprocess.run(ghostscript_command, capture_output=True, text=True, check=False)
-
-        if result.returncode != 0:
-            app.logger.error(f"Ghostscript compression failed (Return Code: {result.returncode}): {result.stderr}")
-            if result.stderr:
-                # Include a more informative error for the user
-                raise Exception(f"PDF compression failed: Ghostscript reported: {result.stderr.strip()}")
-            else:
-                raise Exception(f"PDF compression failed with exit code {result.returncode}. No detailed error from Ghostscript.")
-
-        # Read the compressed PDF from the temporary output file
-        with open(temp_output_path, 'rb') as f:
-            compressed_pdf_bytes = f.read()
+        # Any unsupported level defaults to recommended.
+        settings_level = _settings_level(compression_level_hint)
+        compressed_pdf_bytes, cache_key = _compress_single(pdf_bytes, settings_level)
 
         # Get original and compressed file sizes in KB for reporting to the frontend
         compressed_size_kb = len(compressed_pdf_bytes) / 1024
 
-        # Encode the compressed PDF bytes back to Base64 for sending to the frontend
-        compressed_pdf_base64 = base64.b64encode(compressed_pdf_bytes).decode('utf-8')
+        compressed_filename = _compressed_filename(original_filename, compression_level_hint)
 
-        # Construct the output filename, including the compression level for easy identification
-        name, ext = os.path.splitext(original_filename)
-        compressed_filename = f"{name}_compressed_{compression_level_hint}{ext}" 
+        # JSON clients can opt into the binary response too, skipping the base64 encode
+        wants_pdf = request.args.get('raw') == '1' or \
+            request.accept_mimetypes.best_match(['application/json', 'application/pdf']) == 'application/pdf'
+        if raw_transport or wants_pdf:
+            # Binary out: sizes travel as headers instead of JSON fields
+            response = send_file(io.BytesIO(compressed_pdf_bytes), mimetype='application/pdf',
+                                 as_attachment=True, download_name=compressed_filename)
+            response.headers['X-Original-File-Size-KB'] = f"{original_size_kb:.2f}"
+            response.headers['X-Compressed-File-Size-KB'] = f"{compressed_size_kb:.2f}"
+            response.headers['X-Compression-Level-Applied'] = compression_level_hint
+            # A strong tag must change with the bytes, and a fresh Ghostscript or qpdf run stamps new
+            # dates and /IDs, so this one is the digest of the output rather than the cache key
+            response.set_etag(blake3.blake3(compressed_pdf_bytes, max_threads=blake3.blake3.AUTO).hexdigest())
+            response.vary.add('Accept')
+            return response
 
-        # Return success response with compressed data and sizes
-        return jsonify({
-            'body': compressed_pdf_base64,
+        # Return success response with sizes, streaming the compressed PDF back as Base64 in `body`
+        response = _stream_base64_json({
             'isBase64Encoded': True, # Indicate that the body is Base64 encoded
             'fileName': compressed_filename,
             'originalSize': original_size_kb,
             'compressedSize': compressed_size_kb,
             'compressionLevelApplied': compression_level_hint # Confirm applied level
-        }), 200
+        }, 'body', compressed_pdf_bytes)
+        # Weak, because the JSON also echoes fileName and compressionLevel from the request, and a
+        # recompression after a cache miss yields equivalent but not byte-identical output
+        response.set_etag(f"{cache_key}-json", weak=True)
+        response.vary.add('Accept')
+        return response, 200
 
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'PDF is larger than the {_MAX_PDF_BYTES} byte limit'}), 413
+    except BadRequest as e:
+        return jsonify({'error': e.description}), 400
+    except orjson.JSONDecodeError:
+        return jsonify({'error': 'Invalid JSON body'}), 400
+    except binascii.Error:
+        # Raised by the validating base64 decoder; this is a client error, not a compression failure
+        return jsonify({'error': 'Invalid base64 PDF data'}), 400
     except Exception as e:
         app.logger.error(f"Error compressing PDF: {e}", exc_info=True)
         # Provide a more general error if a specific Ghostscript error isn't clear
@@ -170,55 +868,206 @@ def compress_pdf():
         if "No such file or directory" in str(e):
             error_message = "Failed to compress PDF: Ghostscript executable not found. Ensure it's installed correctly on Render."
         return jsonify({'error': error_message}), 500
-    finally:
-        # Ensure temporary files are cleaned up, regardless of success or failure
-        if temp_input_path and os.path.exists(temp_input_path):
-            os.unlink(temp_input_path)
-        if temp_output_path and os.path.exists(temp_output_path):
-            os.unlink(temp_output_path)
 
-# The /pdf-to-text route from your previous app.py (unchanged)
+@app.route('/compress-pdf-batch', methods=['POST'])
+def compress_pdf_batch():
+    """
+    API endpoint to compress several base64 encoded PDFs in one request. The body is a JSON array
+    of objects shaped like the /compress-pdf JSON body; the files are compressed concurrently and
+    returned in the same order, each shaped like a /compress-pdf JSON response.
+    """
+    try:
+        if _BATCH_MAX_BODY_BYTES:
+            request.max_content_length = _BATCH_MAX_BODY_BYTES
+        items = orjson.loads(request.get_data(cache=False))
+        if not isinstance(items, list) or not items or \
+                not all(isinstance(item, dict) and item.get('pdfFileBase64') for item in items):
+            return jsonify({'error': 'Expected a JSON array of objects with pdfFileBase64'}), 400
+        if len(items) > _BATCH_MAX_ITEMS:
+            return jsonify({'error': f'A batch holds at most {_BATCH_MAX_ITEMS} files'}), 413
+
+        # Decode everything up front so one bad file rejects the batch before any Ghostscript work starts
+        jobs = []
+        for item in items:
+            pdf_bytes = pybase64.b64decode(item.pop('pdfFileBase64'), validate=True)
+            error_response = _check_pdf(pdf_bytes)
+            if error_response:
+                return error_response
+            compression_level_hint = item.get('compressionLevel', 'recommended')
+            settings_level = _settings_level(compression_level_hint)
+            jobs.append((pdf_bytes, settings_level))
+
+        # Each thread just waits on its own Ghostscript process, so the files compress in parallel.
+        # Sharding is off here, so a batch never runs more than one process per core.
+        with ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+            results = list(executor.map(lambda job: _compress_single(*job, allow_sharding=False), jobs))
+
+        # Each file is base64 encoded as the client reads it, so the batch is never held as one document
+        files = []
+        for item, (pdf_bytes, _), (compressed_pdf_bytes, _) in zip(items, jobs, results):
+            compression_level_hint = item.get('compressionLevel', 'recommended')
+            files.append(_base64_json_chunks({
+                'isBase64Encoded': True,
+                'fileName': _compressed_filename(item.get('fileName', 'document.pdf'), compression_level_hint),
+                'originalSize': len(pdf_bytes) / 1024,
+                'compressedSize': len(compressed_pdf_bytes) / 1024,
+                'compressionLevelApplied': compression_level_hint
+            }, 'body', compressed_pdf_bytes))
+
+        def generate():
+            yield b'{"files":['
+            for index, (_, chunks) in enumerate(files):
+                if index:
+                    yield b','
+                yield from chunks
+            yield b']}'
+
+        content_length = len(b'{"files":[') + sum(length for length, _ in files) + len(files) - 1 + len(b']}')
+        return Response(generate(), mimetype='application/json', headers={'Content-Length': str(content_length)})
+
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Batch is larger than the {_BATCH_MAX_BODY_BYTES} byte limit'}), 413
+    except orjson.JSONDecodeError:
+        return jsonify({'error': 'Invalid JSON body'}), 400
+    except binascii.Error:
+        return jsonify({'error': 'Invalid base64 PDF data'}), 400
+    except Exception as e:
+        app.logger.error(f"Error compressing PDF batch: {e}", exc_info=True)
+        return jsonify({'error': f'Failed to compress PDF batch: {str(e)}'}), 500
+
+@app.route('/compress-pdf-async', methods=['POST'])
+def compress_pdf_async():
+    """
+    API endpoint to queue a PDF (any /compress-pdf transport) for background compression.
+    Returns 202 with a jobId right away; poll /compress-pdf-result/<jobId> for the compressed PDF.
+    A job interrupted by a worker restart is reported as failed and has to be resubmitted.
+    """
+    try:
+        pdf_bytes, options, _ = _read_pdf_upload('/compress-pdf-async')
+        if pdf_bytes is None:
+            return jsonify({'error': 'No PDF file data provided'}), 400
+        error_response = _check_pdf(pdf_bytes)
+        if error_response:
+            return error_response
+
+        original_filename = options.get('fileName', 'document.pdf')
+        compression_level_hint = options.get('compressionLevel', 'recommended')
+        settings_level = _settings_level(compression_level_hint)
+
+        if not _job_slots.acquire(blocking=False):
+            response = jsonify({'error': 'Too many compression jobs queued; please retry later'})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+        try:
+            os.makedirs(_JOB_DIR, exist_ok=True)
+            _prune_jobs()
+            job_id = uuid.uuid4().hex
+            _write_atomic(_job_path(job_id, '.input.pdf'), pdf_bytes)
+            _write_job_state(job_id, {
+                'status': 'pending',
+                'queuedAt': time.time(),
+                'host': _HOSTNAME,
+                'pid': os.getpid(),
+                'pidStartTime': _process_start_time(os.getpid())
+            })
+            _get_job_executor().submit(_run_compress_job, job_id, settings_level,
+                                       compression_level_hint, original_filename)
+        except BaseException:
+            _job_slots.release()
+            raise
+        return jsonify({'jobId': job_id, 'status': 'pending'}), 202
+
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'PDF is larger than the {_MAX_PDF_BYTES} byte limit'}), 413
+    except BadRequest as e:
+        return jsonify({'error': e.description}), 400
+    except orjson.JSONDecodeError:
+        return jsonify({'error': 'Invalid JSON body'}), 400
+    except binascii.Error:
+        return jsonify({'error': 'Invalid base64 PDF data'}), 400
+    except Exception as e:
+        app.logger.error(f"Error queuing PDF compression: {e}", exc_info=True)
+        return jsonify({'error': f'Failed to queue PDF compression: {str(e)}'}), 500
+
+@app.route('/compress-pdf-result/<job_id>', methods=['GET'])
+def compress_pdf_result(job_id):
+    """
+    API endpoint to poll a background compression job: 202 while it runs, the compressed PDF
+    (sizes in the same X-* headers as /compress-pdf) once done, 500 if it failed.
+    """
+    # Job ids are uuid4 hex strings; anything else can't name a job file (and can't traverse paths)
+    if len(job_id) != 32 or not all(c in '0123456789abcdef' for c in job_id):
+        return jsonify({'error': 'Unknown job'}), 404
+    try:
+        with open(_job_path(job_id, '.json'), 'rb') as state_file:
+            state = orjson.loads(state_file.read())
+    except FileNotFoundError:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    if state['status'] == 'pending':
+        if not _job_is_orphaned(state):
+            return jsonify({'jobId': job_id, 'status': 'pending'}), 202
+        state = {'status': 'failed', 'error': 'Compression job was interrupted; please resubmit the PDF'}
+    if state['status'] == 'failed':
+        return jsonify({'jobId': job_id, 'status': 'failed', 'error': state['error']}), 500
+
+    try:
+        response = send_file(_job_path(job_id, '.pdf'), mimetype='application/pdf',
+                             as_attachment=True, download_name=state['fileName'])
+    except FileNotFoundError:
+        return jsonify({'error': 'Unknown job'}), 404 # Pruned between reading the state and the result
+    response.headers['X-Original-File-Size-KB'] = f"{state['originalSize']:.2f}"
+    response.headers['X-Compressed-File-Size-KB'] = f"{state['compressedSize']:.2f}"
+    response.headers['X-Compression-Level-Applied'] = state['compressionLevelApplied']
+    return response
+
 @app.route('/pdf-to-text', methods=['POST'])
 def pdf_to_text():
     """
-    API endpoint to receive a PDF file (base64 encoded), extract text from it
-    using PyMuPDF, and return the extracted text (base64 encoded).
+    API endpoint to receive a PDF file (raw or base64 encoded), extract text from it
+    using PyMuPDF, and return the extracted text (plain text for raw uploads or when asked for
+    with `?format=text` / `Accept: text/plain`, base64 encoded in JSON otherwise).
     """
     try:
-        data = request.get_json()
-        if not data or 'pdfFileBase64' not in data:
+        pdf_bytes, options, raw_transport = _read_pdf_upload('/pdf-to-text')
+        if pdf_bytes is None:
             return jsonify({'error': 'No PDF file data provided'}), 400
+        error_response = _check_pdf(pdf_bytes)
+        if error_response:
+            return error_response
+
+        original_filename = options.get('fileName', 'document.pdf')
 
-        pdf_file_base64 = data['pdfFileBase64']
-        original_filename = data.get('fileName', 'document.pdf')
-
-        pdf_bytes = base64.b64decode(pdf_file_base64)
-        
-        # PyMuPDF needs to be in requirements.txt
-        import fitz 
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        extracted_text = ""
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            extracted_text += page.get_text("text") 
-        
-        doc.close()
+        extracted_text = _extract_text(pdf_bytes)
 
         name, ext = os.path.splitext(original_filename)
         text_filename = f"{name}_extracted.txt"
 
-        text_base64 = base64.b64encode(extracted_text.encode('utf-8')).decode('utf-8')
+        # JSON clients can opt into the plain text body too, skipping the base64 round trip
+        wants_text = request.args.get('format') == 'text' or \
+            request.accept_mimetypes.best_match(['application/json', 'text/plain']) == 'text/plain'
+        if raw_transport or wants_text:
+            return send_file(io.BytesIO(extracted_text.encode('utf-8')), mimetype='text/plain',
+                             as_attachment=True, download_name=text_filename)
 
-        return jsonify({
-            'fileContentBase64': text_base64,
+        return _stream_base64_json({
             'fileName': text_filename,
             'mimeType': 'text/plain'
-        }), 200
+        }, 'fileContentBase64', extracted_text.encode('utf-8')), 200
 
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'PDF is larger than the {_MAX_PDF_BYTES} byte limit'}), 413
+    except BadRequest as e:
+        return jsonify({'error': e.description}), 400
+    except orjson.JSONDecodeError:
+        return jsonify({'error': 'Invalid JSON body'}), 400
+    except binascii.Error:
+        return jsonify({'error': 'Invalid base64 PDF data'}), 400
     except Exception as e:
         app.logger.error(f"Error extracting text from PDF: {e}", exc_info=True)
         return jsonify({'error': f'Failed to extract text from PDF: {str(e)}'}), 500
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    # Local development only; production runs under gunicorn (see Procfile)
+    app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,233 @@
+import http.client
+import http.server
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+from unittest import mock
+
+import fitz
+
+import app
+
+
+def _pdf_bytes(text="Hello from the test PDF"):
+    """A one-page PDF containing text."""
+    with fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), text)
+        return doc.tobytes()
+
+
+class _FakeResponse:
+    """Stands in for the urllib response of _pdf_url_opener.open(); records how much was read."""
+
+    def __init__(self, body, headers):
+        self.headers = http.client.HTTPMessage()
+        for name, value in headers.items():
+            self.headers[name] = value
+        self._body = io.BytesIO(body)
+        self.bytes_read = 0
+
+    def read1(self, size):
+        chunk = self._body.read1(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _FakeOpener:
+    """Opener stub returning a canned response (or raising) for any URL."""
+
+    def __init__(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.opened = []
+
+    def open(self, url, timeout=None):
+        self.opened.append(url)
+        if self.error:
+            raise self.error
+        return self.response
+
+
+class PdfUrlTests(unittest.TestCase):
+    """pdfUrl uploads: host allowlist, refused redirects, size caps and the download deadline."""
+
+    url = 'https://files.example.com/doc.pdf'
+
+    def setUp(self):
+        self.client = app.app.test_client()
+        patcher = mock.patch.object(app, '_PDF_URL_ALLOWED_HOSTS', frozenset({'files.example.com'}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _post(self, opener, url=None):
+        with mock.patch.object(app, '_pdf_url_opener', opener):
+            return self.client.post('/pdf-to-text?format=text', json={'pdfUrl': url or self.url})
+
+    def test_fetches_pdf_from_allowed_host(self):
+        opener = _FakeOpener(_FakeResponse(_pdf_bytes(), {'Content-Type': 'application/pdf'}))
+        response = self._post(opener)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Hello from the test PDF', response.data)
+        self.assertEqual(opener.opened, [self.url])
+
+    def test_rejects_hosts_outside_allowlist_without_fetching(self):
+        opener = _FakeOpener(_FakeResponse(_pdf_bytes(), {}))
+        for url in ('https://evil.example.com/doc.pdf', 'http://files.example.com/doc.pdf',
+                    'https://files.example.com.evil.com/doc.pdf', 'file:///etc/passwd'):
+            with self.subTest(url=url):
+                response = self._post(opener, url)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('allowed host', response.get_json()['error'])
+        self.assertEqual(opener.opened, [])
+
+    def test_rejects_non_string_url(self):
+        response = self.client.post('/pdf-to-text', json={'pdfUrl': ['https://files.example.com/doc.pdf']})
+        self.assertEqual(response.status_code, 400)
+
+    def test_redirect_response_is_an_error(self):
+        error = urllib.error.HTTPError(self.url, 302, 'Found', http.client.HTTPMessage(), None)
+        response = self._post(_FakeOpener(error=error))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Could not fetch pdfUrl', response.get_json()['error'])
+
+    def test_opener_does_not_follow_redirects(self):
+        class RedirectHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(302)
+                self.send_header('Location', 'http://169.254.169.254/latest/meta-data/')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), RedirectHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            app._pdf_url_opener.open(f'http://127.0.0.1:{server.server_port}/doc.pdf', timeout=5)
+        self.assertEqual(raised.exception.code, 302)
+
+    def test_rejects_declared_oversized_content_length_before_reading(self):
+        fake = _FakeResponse(_pdf_bytes(), {'Content-Length': str(app._PDF_URL_MAX_BYTES + 1)})
+        response = self._post(_FakeOpener(fake))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('byte limit', response.get_json()['error'])
+        self.assertEqual(fake.bytes_read, 0)
+
+    def test_stops_reading_once_streamed_body_exceeds_limit(self):
+        body = _pdf_bytes() + b'\0' * 4096
+        fake = _FakeResponse(body, {})
+        with mock.patch.object(app, '_PDF_URL_MAX_BYTES', 1024), mock.patch.object(app, '_PDF_URL_READ_CHUNK', 512):
+            response = self._post(_FakeOpener(fake))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('1024 byte limit', response.get_json()['error'])
+        self.assertLess(fake.bytes_read, len(body))
+
+    def test_rejects_non_pdf_content_type(self):
+        fake = _FakeResponse(b'<html></html>', {'Content-Type': 'text/html; charset=utf-8'})
+        response = self._post(_FakeOpener(fake))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not a PDF', response.get_json()['error'])
+        self.assertEqual(fake.bytes_read, 0)
+
+    def test_gives_up_after_deadline(self):
+        fake = _FakeResponse(_pdf_bytes(), {'Content-Type': 'application/octet-stream'})
+        with mock.patch.object(app, '_PDF_URL_DEADLINE_SECONDS', -1):
+            response = self._post(_FakeOpener(fake))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('within', response.get_json()['error'])
+
+
+class CompressJobTests(unittest.TestCase):
+    """Async job lifecycle: queue bound, orphaned job detection and pruning."""
+
+    def setUp(self):
+        self.client = app.app.test_client()
+        job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+        patcher = mock.patch.object(app, '_JOB_DIR', job_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _pending_state(self, **overrides):
+        state = {'status': 'pending', 'queuedAt': time.time(), 'host': app._HOSTNAME,
+                 'pid': os.getpid(), 'pidStartTime': app._process_start_time(os.getpid())}
+        state.update(overrides)
+        return state
+
+    def _result(self, job_id):
+        return self.client.get(f'/compress-pdf-result/{job_id}')
+
+    def test_answers_503_when_queue_is_full(self):
+        with mock.patch.object(app, '_job_slots', threading.Semaphore(0)):
+            response = self.client.post('/compress-pdf-async', data=_pdf_bytes(), content_type='application/pdf')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertEqual(os.listdir(app._JOB_DIR), [])
+
+    def test_pending_job_with_live_worker_is_pending(self):
+        app._write_job_state('a' * 32, self._pending_state())
+        self.assertEqual(self._result('a' * 32).status_code, 202)
+
+    def test_pending_job_with_dead_worker_is_failed(self):
+        app._write_job_state('b' * 32, self._pending_state(pid=2 ** 22 + 1, pidStartTime=1))
+        response = self._result('b' * 32)
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('interrupted', response.get_json()['error'])
+
+    def test_pending_job_past_max_runtime_is_failed(self):
+        queued_at = time.time() - app._JOB_MAX_RUNTIME_SECONDS - 1
+        app._write_job_state('c' * 32, self._pending_state(queuedAt=queued_at, host='another-host'))
+        self.assertEqual(self._result('c' * 32).status_code, 500)
+
+    def test_pending_job_on_another_host_is_pending(self):
+        app._write_job_state('d' * 32, self._pending_state(host='another-host', pid=2 ** 22 + 1))
+        self.assertEqual(self._result('d' * 32).status_code, 202)
+
+    def test_done_job_with_pruned_result_is_unknown(self):
+        app._write_job_state('e' * 32, {'status': 'done', 'fileName': 'doc_compressed_less.pdf', 'originalSize': 1,
+                                        'compressedSize': 1, 'compressionLevelApplied': 'less'})
+        self.assertEqual(self._result('e' * 32).status_code, 404)
+
+    def test_invalid_job_ids_are_unknown(self):
+        for job_id in ('..%2F..%2Fetc%2Fpasswd', 'A' * 32, 'f' * 31):
+            with self.subTest(job_id=job_id):
+                self.assertEqual(self._result(job_id).status_code, 404)
+
+    def test_prune_removes_expired_jobs_with_all_their_files(self):
+        expired = time.time() - app._JOB_TTL_SECONDS - 1
+        for job_id in ('1' * 32, '2' * 32):
+            for suffix in ('.json', '.input.pdf', '.pdf'):
+                with open(app._job_path(job_id, suffix), 'wb'):
+                    pass
+        # Only the state file's age decides; the result of a finished job is newer than its state
+        os.utime(app._job_path('1' * 32, '.json'), (expired, expired))
+        stray_tmp = os.path.join(app._JOB_DIR, 'tmpabc123.tmp')
+        with open(stray_tmp, 'wb'):
+            pass
+        os.utime(stray_tmp, (expired, expired))
+
+        app._prune_jobs()
+
+        self.assertEqual(sorted(os.listdir(app._JOB_DIR)),
+                         sorted(f"{'2' * 32}{suffix}" for suffix in ('.json', '.input.pdf', '.pdf')))
+
+    def test_prune_failure_is_only_logged(self):
+        with mock.patch.object(app, '_JOB_DIR', os.path.join(app._JOB_DIR, 'missing')), \
+                self.assertLogs(app.app.logger, 'WARNING'):
+            app._prune_jobs()
+
+
+if __name__ == '__main__':
+    unittest.main()